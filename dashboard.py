@@ -1,9 +1,12 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import re
 import student_analysis as sa
+from io import BytesIO
 from pathlib import Path
 
 st.set_page_config(
@@ -41,20 +44,48 @@ def infer_grade(mark):
 
 def ensure_grades(df):
     """
-    If the gazette had no grade letters, all _G columns will be empty strings.
+    If the gazette had no grade letters, all _G columns will be missing (NaN).
     Fill them in from marks so that all grade-based charts / tables work correctly.
     """
     for s in sa.SUBJECTS:
         gc = f"{s}_G"
         mc = f"{s}_M"
-        if gc in df.columns and df[gc].eq("").all():
-            df[gc] = pd.to_numeric(df[mc], errors="coerce").apply(
+        if gc in df.columns and df[gc].isna().all():
+            df[gc] = df[mc].apply(
                 lambda v: infer_grade(v) if not pd.isna(v) else ""
-            )
+            ).astype(sa.GRADE_DTYPE)
     return df
 
+@st.cache_data(show_spinner=False)
+def load_gazette(data):
+    """
+    Parse an uploaded gazette. Cached on the raw file bytes, so widget
+    changes (subject, Top-N, ...) rerun the script without re-parsing.
+    The bytes are scanned as-is; only the header lines are decoded here.
+    Returns (school_name, df).
+    """
+    school_name = "School"
+    # Header lines end on the same separators parse_bytes() breaks records on.
+    for ln in re.split(rb"\r\n|[" + sa._EOL + rb"]", data, 20)[:20]:
+        m = re.search(r"SCHOOL\s*[:\-\s]+\d+\s+(.+)", ln.decode("utf-8", errors="ignore"))
+        if m:
+            school_name = m.group(1).strip()
+            break
+
+    df = sa.parse_bytes(data)
+    if not df.empty:
+        # Fill grades from marks if gazette had no grade letters
+        df = ensure_grades(df)
+    return school_name, df
+
+@st.cache_data(show_spinner=False)
+def build_excel_bytes(df):
+    """Excel report for ``df``; rebuilt only when the parsed data changes."""
+    return sa.build_excel(df)
+
 SUBJECTS    = sa.SUBJECTS
 SUBJ_LABELS = sa.SUBJ_LABELS
+MARK_COLS   = sa.MARK_COLS
 SEAL_PATH   = Path(__file__).with_name("Quality_verified_seal_design-removebg-preview.png")
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -93,26 +124,17 @@ if not uploaded:
 # ══════════════════════════════════════════════════════════════════════════════
 # PARSE
 # ══════════════════════════════════════════════════════════════════════════════
-raw   = uploaded.read().decode("utf-8", errors="ignore")
-lines = raw.splitlines()
-
-school_name = "School"
-for ln in lines[:20]:
-    m = re.search(r"SCHOOL\s*[:\-\s]+\d+\s+(.+)", ln)
-    if m:
-        school_name = m.group(1).strip()
-        break
-
-df = sa.parse(lines)
+school_name, df = load_gazette(uploaded.getvalue())
 if df.empty:
     st.error("No student records found. Check the file format.")
     st.stop()
 
-# Fill grades from marks if gazette had no grade letters
-df = ensure_grades(df)
-
-mark_cols   = [f"{s}_M" for s in SUBJECTS]
-lang_groups = df.groupby("Lang2_Name")
+# 2nd language → (mean, size) of Total; gender (M, F) × subject average
+lang_totals = df.groupby("Lang2_Name")["Total"].agg(["mean", "size"])
+gender_avgs = df.groupby("Gender", observed=True)[MARK_COLS].mean().reindex(["M", "F"])
+subj_stats  = sa.subject_stats(df)   # subject → (mean, median, max, min, std)
+grade_mat   = sa.grade_matrix(df)    # subject × grade counts
+present_g   = [g for g in sa.GRADE_ORDER if grade_mat[g].any()]   # grades that occur
 
 # ══════════════════════════════════════════════════════════════════════════════
 # HEADER
@@ -131,7 +153,7 @@ k6.metric("Boys",            int((df.Gender == "M").sum()))
 
 # ── Language group summary ────────────────────────────────────────────────────
 lang_summary = "  |  ".join(
-    f"🌐 **{lang}**: {len(g)} {'student' if len(g) == 1 else 'students'}" for lang, g in lang_groups
+    f"🌐 **{lang}**: {n} {'student' if n == 1 else 'students'}" for lang, n in lang_totals["size"].items()
 )
 st.markdown(lang_summary)
 
@@ -149,17 +171,35 @@ st.divider()
 st.subheader("📊 Class Overview")
 
 def make_fig(figsize=(5, 3.8)):
-    fig, ax = plt.subplots(figsize=figsize)
+    # Plain Figure on an Agg canvas: not registered with pyplot, so nothing
+    # accumulates in its global figure list across Streamlit reruns.
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    style_ax(ax)
+    return fig, ax
+
+def style_ax(ax):
     for spine in ax.spines.values():
         spine.set_visible(False)
     ax.grid(axis="y", linewidth=0.7, alpha=0.4)
-    return fig, ax
 
-col1, col2, col3 = st.columns(3)
-
-with col1:
+def fig_png(fig):
+    """
+    Render ``fig`` to PNG bytes at st.pyplot's resolution. Every chart calls
+    fig.tight_layout() first, so bbox_inches="tight" (a second full draw
+    just to measure the bounding box) is skipped.
+    """
+    buf = BytesIO()
+    fig.savefig(buf, format="png", dpi=200)
+    return buf.getvalue()
+
+# Chart renderers only draw: the page computes each chart's data and passes
+# it in. chart_overview / chart_subject_panels cache the PNG bytes keyed on
+# that data, so reruns that only move the Top-N slider or switch subject
+# re-serve unchanged charts.
+def chart_subject_averages(avgs):
     fig, ax = make_fig()
-    avgs   = [pd.to_numeric(df[f"{s}_M"], errors="coerce").mean() for s in SUBJECTS]
     colors = ["#2E75B6","#1A7A4A","#E8A838","#6B2FBE","#D63384"]
     bars   = ax.bar([SUBJ_LABELS[s] for s in SUBJECTS], avgs, color=colors,
                     width=0.55, zorder=2, edgecolor="white", linewidth=0.8)
@@ -171,15 +211,12 @@ with col1:
     ax.tick_params(axis="x", labelsize=7.5, rotation=15)
     ax.tick_params(axis="y", labelsize=8)
     fig.tight_layout()
-    st.pyplot(fig, use_container_width=True)
-    plt.close(fig)
+    return fig_png(fig)
 
-with col2:
+def chart_gender_by_subject(m_avgs, f_avgs):
     fig, ax = make_fig()
     x = np.arange(len(SUBJECTS))
     w = 0.36
-    m_avgs = [pd.to_numeric(df[df.Gender=="M"][f"{s}_M"], errors="coerce").mean() for s in SUBJECTS]
-    f_avgs = [pd.to_numeric(df[df.Gender=="F"][f"{s}_M"], errors="coerce").mean() for s in SUBJECTS]
     ax.bar(x - w/2, m_avgs, w, label="Male",   color="#3182BD", alpha=0.9, zorder=2)
     ax.bar(x + w/2, f_avgs, w, label="Female", color="#D63384", alpha=0.9, zorder=2)
     ax.set_xticks(x)
@@ -189,69 +226,34 @@ with col2:
     ax.legend(fontsize=8, frameon=False)
     ax.tick_params(axis="y", labelsize=8)
     fig.tight_layout()
-    st.pyplot(fig, use_container_width=True)
-    plt.close(fig)
+    return fig_png(fig)
 
-with col3:
-    present_g = [g for g in sa.GRADE_ORDER
-                 if any(df[f"{s}_G"].eq(g).any() for s in SUBJECTS)]
-    if present_g:
-        mat = pd.DataFrame(
-            {g: [df[f"{s}_G"].eq(g).sum() for s in SUBJECTS] for g in present_g},
-            index=[SUBJ_LABELS[s] for s in SUBJECTS]
-        )
-        fig, ax = make_fig()
-        vmax = mat.values.max() if mat.size > 0 else 1
-        im = ax.imshow(mat.values, cmap=plt.cm.RdYlGn, aspect="auto", vmin=0, vmax=vmax)
-        ax.set_xticks(range(len(present_g)))
-        ax.set_xticklabels(present_g, fontsize=8)
-        ax.set_yticks(range(len(SUBJECTS)))
-        ax.set_yticklabels(mat.index, fontsize=8)
-        for i in range(len(SUBJECTS)):
-            for j in range(len(present_g)):
-                v = int(mat.values[i, j])
-                if v > 0:
-                    ax.text(j, i, str(v), ha="center", va="center", fontsize=9, fontweight="600",
-                            color="white" if mat.values[i, j] > vmax * 0.5 else "#333")
-        ax.set_title("Grade Count Heatmap", fontsize=10, fontweight="600", pad=8)
-        fig.tight_layout()
-        st.pyplot(fig, use_container_width=True)
-        plt.close(fig)
+def chart_grade_heatmap(mat, inferred):
+    """Subject × column count heatmap; ``inferred`` = marks ranges, not grades."""
+    fig, ax = make_fig()
+    vmax = int(mat.values.max()) if mat.size > 0 else 1
+    ax.imshow(mat.values, cmap=matplotlib.colormaps["RdYlGn"], aspect="auto", vmin=0, vmax=vmax)
+    ax.set_xticks(range(len(mat.columns)))
+    if inferred:
+        ax.set_xticklabels(mat.columns, fontsize=7, rotation=30)
     else:
-        # Fallback: show a marks-range heatmap when no grade letters present
-        ranges   = ["33-40","41-50","51-60","61-70","71-80","81-90","91-100"]
-        bins     = [33, 41, 51, 61, 71, 81, 91, 101]
-        mat_data = {}
-        for rng, lo, hi in zip(ranges, bins[:-1], bins[1:]):
-            mat_data[rng] = [
-                int(pd.to_numeric(df[f"{s}_M"], errors="coerce")
-                    .between(lo, hi - 1).sum())
-                for s in SUBJECTS
-            ]
-        mat = pd.DataFrame(mat_data, index=[SUBJ_LABELS[s] for s in SUBJECTS])
-        fig, ax = make_fig()
-        vmax = int(mat.values.max()) if mat.size > 0 else 1
-        ax.imshow(mat.values, cmap=plt.cm.RdYlGn, aspect="auto", vmin=0, vmax=vmax)
-        ax.set_xticks(range(len(ranges)))
-        ax.set_xticklabels(ranges, fontsize=7, rotation=30)
-        ax.set_yticks(range(len(SUBJECTS)))
-        ax.set_yticklabels(mat.index, fontsize=8)
-        for i in range(len(SUBJECTS)):
-            for j in range(len(ranges)):
-                v = int(mat.values[i, j])
-                if v > 0:
-                    ax.text(j, i, str(v), ha="center", va="center", fontsize=8, fontweight="600",
-                            color="white" if mat.values[i, j] > vmax * 0.5 else "#333")
-        ax.set_title("Marks Range Heatmap", fontsize=10, fontweight="600", pad=8)
-        fig.tight_layout()
-        st.pyplot(fig, use_container_width=True)
-        plt.close(fig)
-
-col4, col5 = st.columns([3, 2])
+        ax.set_xticklabels(mat.columns, fontsize=8)
+    ax.set_yticks(range(len(mat.index)))
+    ax.set_yticklabels(mat.index, fontsize=8)
+    for i in range(len(mat.index)):
+        for j in range(len(mat.columns)):
+            v = int(mat.values[i, j])
+            if v > 0:
+                ax.text(j, i, str(v), ha="center", va="center",
+                        fontsize=8 if inferred else 9, fontweight="600",
+                        color="white" if mat.values[i, j] > vmax * 0.5 else "#333")
+    title = "Marks Range Heatmap" if inferred else "Grade Count Heatmap"
+    ax.set_title(title, fontsize=10, fontweight="600", pad=8)
+    fig.tight_layout()
+    return fig_png(fig)
 
-with col4:
+def chart_total_distribution(vals):
     fig, ax = make_fig(figsize=(7, 3.5))
-    vals = df["Total"].dropna()
     ax.hist(vals, bins=18, color="#2E75B6", edgecolor="white", linewidth=0.8, alpha=0.88, zorder=2)
     ax.axvline(vals.mean(),   color="#E8A838", lw=2, linestyle="--", label=f"Mean: {vals.mean():.1f}")
     ax.axvline(vals.median(), color="#1A7A4A", lw=2, linestyle="--", label=f"Median: {vals.median():.1f}")
@@ -261,13 +263,9 @@ with col4:
     ax.legend(fontsize=8, frameon=False)
     ax.tick_params(labelsize=8)
     fig.tight_layout()
-    st.pyplot(fig, use_container_width=True)
-    plt.close(fig)
+    return fig_png(fig)
 
-with col5:
-    lang_names = [ln for ln, _ in lang_groups]
-    lang_avgs  = [grp["Total"].mean() for _, grp in lang_groups]
-    lang_cnts  = [len(grp) for _, grp in lang_groups]
+def chart_lang2_totals(lang_names, lang_avgs, lang_cnts):
     fig, ax = make_fig(figsize=(4.5, 3.5))
     bar_colors = ["#2E75B6","#1A7A4A","#E8A838","#6B2FBE"]
     bars = ax.bar(lang_names, lang_avgs,
@@ -279,8 +277,64 @@ with col5:
     ax.set_title("Avg Total by 2nd Language", fontsize=10, fontweight="600", pad=8)
     ax.tick_params(labelsize=8)
     fig.tight_layout()
-    st.pyplot(fig, use_container_width=True)
-    plt.close(fig)
+    return fig_png(fig)
+
+@st.cache_data(show_spinner=False)
+def chart_overview(avgs, m_avgs, f_avgs, mat, inferred, totals,
+                   lang_names, lang_avgs, lang_cnts):
+    """PNGs for the five Class Overview charts, cached together on their data."""
+    return [chart_subject_averages(avgs),
+            chart_gender_by_subject(m_avgs, f_avgs),
+            chart_grade_heatmap(mat, inferred),
+            chart_total_distribution(totals),
+            chart_lang2_totals(lang_names, lang_avgs, lang_cnts)]
+
+avgs = [subj_stats[s][0] for s in SUBJECTS]
+
+m_avgs = gender_avgs.loc["M"].to_numpy(dtype=float, na_value=np.nan)
+f_avgs = gender_avgs.loc["F"].to_numpy(dtype=float, na_value=np.nan)
+
+if present_g:
+    mat = grade_mat[present_g].rename(index=SUBJ_LABELS)
+else:
+    # Fallback: show a marks-range heatmap when no grade letters present
+    ranges   = ["33-40","41-50","51-60","61-70","71-80","81-90","91-100"]
+    bins     = [33, 41, 51, 61, 71, 81, 91, 101]
+    mat_data = {}
+    for rng, lo, hi in zip(ranges, bins[:-1], bins[1:]):
+        mat_data[rng] = [
+            int(df[f"{s}_M"].between(lo, hi - 1).sum())
+            for s in SUBJECTS
+        ]
+    mat = pd.DataFrame(mat_data, index=[SUBJ_LABELS[s] for s in SUBJECTS])
+
+lang_names = lang_totals.index.tolist()
+lang_avgs  = lang_totals["mean"].tolist()
+lang_cnts  = lang_totals["size"].tolist()
+
+png_avgs, png_gender, png_heat, png_total, png_lang = chart_overview(
+    avgs, m_avgs, f_avgs, mat, not present_g, df["Total"].dropna(),
+    lang_names, lang_avgs, lang_cnts
+)
+
+col1, col2, col3 = st.columns(3)
+
+with col1:
+    st.image(png_avgs, use_column_width=True)
+
+with col2:
+    st.image(png_gender, use_column_width=True)
+
+with col3:
+    st.image(png_heat, use_column_width=True)
+
+col4, col5 = st.columns([3, 2])
+
+with col4:
+    st.image(png_total, use_column_width=True)
+
+with col5:
+    st.image(png_lang, use_column_width=True)
 
 st.divider()
 
@@ -296,68 +350,54 @@ subj_sel = st.selectbox(
 )
 mc = f"{subj_sel}_M"
 gc = f"{subj_sel}_G"
-s  = pd.to_numeric(df[mc], errors="coerce").dropna()
+s  = df[mc].dropna().astype("float64")
 
-m1, m2, m3, m4, m5 = st.columns(5)
-m1.metric("Average",  f"{s.mean():.1f}")
-m2.metric("Median",   f"{s.median():.1f}")
-m3.metric("Highest",  int(s.max()) if not s.empty else "—")
-m4.metric("Lowest",   int(s.min()) if not s.empty else "—")
-m5.metric("A1+A2 %",  f"{df[gc].isin(['A1','A2']).sum() / len(df) * 100:.0f}%")
+avg, med, hi, lo, _ = subj_stats[subj_sel]
 
-ca, cb, cc = st.columns(3)
-
-with ca:
-    fig, ax = make_fig()
+m1, m2, m3, m4, m5 = st.columns(5)
+m1.metric("Average",  f"{avg:.1f}")
+m2.metric("Median",   f"{med:.1f}")
+m3.metric("Highest",  hi if not s.empty else "—")
+m4.metric("Lowest",   lo if not s.empty else "—")
+m5.metric("A1+A2 %",  f"{grade_mat.loc[subj_sel, ['A1','A2']].sum() / len(df) * 100:.0f}%")
+
+# The three deep-dive charts share one Figure: each is drawn on the same
+# axes, saved, and the axes cleared (and restyled) for the next one.
+def draw_subject_hist(ax, subj, s):
     ax.hist(s, bins=14, color="#2E75B6", edgecolor="white", linewidth=0.8, alpha=0.88, zorder=2)
     ax.axvline(s.mean(),   color="#E8A838", lw=2, linestyle="--", label=f"Mean {s.mean():.1f}")
     ax.axvline(s.median(), color="#1A7A4A", lw=2, linestyle="--", label=f"Median {s.median():.1f}")
-    ax.set_title(f"{SUBJ_LABELS[subj_sel]} — Marks Distribution", fontsize=10, fontweight="600", pad=8)
+    ax.set_title(f"{SUBJ_LABELS[subj]} — Marks Distribution", fontsize=10, fontweight="600", pad=8)
     ax.set_xlabel("Marks", fontsize=8)
     ax.legend(fontsize=8, frameon=False)
     ax.tick_params(labelsize=8)
-    fig.tight_layout()
-    st.pyplot(fig, use_container_width=True)
-    plt.close(fig)
 
-with cb:
-    grade_counts = df[gc].value_counts().reindex(sa.GRADE_ORDER).dropna()
+def draw_subject_grades(ax, subj, grade_counts, s):
     grade_counts = grade_counts[grade_counts > 0]
     if not grade_counts.empty:
-        fig, ax = make_fig()
         bars = ax.bar(grade_counts.index, grade_counts.values,
                       color=grade_palette(grade_counts.index),
                       edgecolor="white", linewidth=0.8, zorder=2)
         for bar, v in zip(bars, grade_counts.values):
             ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.1,
                     str(int(v)), ha="center", va="bottom", fontsize=9, fontweight="600")
-        ax.set_title(f"{SUBJ_LABELS[subj_sel]} — Grade Distribution", fontsize=10, fontweight="600", pad=8)
+        ax.set_title(f"{SUBJ_LABELS[subj]} — Grade Distribution", fontsize=10, fontweight="600", pad=8)
         ax.tick_params(labelsize=9)
-        fig.tight_layout()
-        st.pyplot(fig, use_container_width=True)
-        plt.close(fig)
     else:
         # Fallback: marks-range bar chart
         bins_e   = [0,33,41,51,61,71,81,91,101]
         labels_e = ["<33","D1","C2","C1","B2","B1","A2","A1"]
         counts_e = pd.cut(s, bins=bins_e, labels=labels_e, right=False).value_counts().reindex(labels_e).fillna(0)
-        fig, ax  = make_fig()
         clrs = [GRADE_COLORS_HEX.get(l, "#aaaaaa") for l in labels_e]
         bars = ax.bar(labels_e, counts_e.values, color=clrs, edgecolor="white", linewidth=0.8, zorder=2)
         for bar, v in zip(bars, counts_e.values):
             if v > 0:
                 ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.1,
                         str(int(v)), ha="center", va="bottom", fontsize=9, fontweight="600")
-        ax.set_title(f"{SUBJ_LABELS[subj_sel]} — Grade Distribution (inferred)", fontsize=10, fontweight="600", pad=8)
+        ax.set_title(f"{SUBJ_LABELS[subj]} — Grade Distribution (inferred)", fontsize=10, fontweight="600", pad=8)
         ax.tick_params(labelsize=9)
-        fig.tight_layout()
-        st.pyplot(fig, use_container_width=True)
-        plt.close(fig)
 
-with cc:
-    fig, ax = make_fig()
-    m_vals = pd.to_numeric(df[df.Gender=="M"][mc], errors="coerce").dropna()
-    f_vals = pd.to_numeric(df[df.Gender=="F"][mc], errors="coerce").dropna()
+def draw_subject_gender_box(ax, subj, m_vals, f_vals):
     bp = ax.boxplot([m_vals, f_vals], labels=["Male", "Female"],
                     patch_artist=True, widths=0.4,
                     medianprops=dict(color="white", linewidth=2))
@@ -366,28 +406,58 @@ with cc:
     for element in ["whiskers", "caps", "fliers"]:
         for item in bp[element]:
             item.set(color="#666666", linewidth=1.2)
-    ax.set_title(f"{SUBJ_LABELS[subj_sel]} — Gender Boxplot", fontsize=10, fontweight="600", pad=8)
+    ax.set_title(f"{SUBJ_LABELS[subj]} — Gender Boxplot", fontsize=10, fontweight="600", pad=8)
     ax.tick_params(labelsize=9)
-    fig.tight_layout()
-    st.pyplot(fig, use_container_width=True)
-    plt.close(fig)
+
+@st.cache_data(show_spinner=False)
+def chart_subject_panels(subj, s, grade_counts, m_vals, f_vals):
+    """PNGs for the histogram, grade bars and gender boxplot of ``subj``."""
+    fig, ax = make_fig()
+    pngs = []
+    for draw, args in ((draw_subject_hist,       (s,)),
+                       (draw_subject_grades,     (grade_counts, s)),
+                       (draw_subject_gender_box, (m_vals, f_vals))):
+        if pngs:
+            ax.clear()
+            style_ax(ax)
+        draw(ax, subj, *args)
+        fig.tight_layout()
+        pngs.append(fig_png(fig))
+    return pngs
+
+m_vals = df.loc[df.Gender == "M", mc].dropna()
+f_vals = df.loc[df.Gender == "F", mc].dropna()
+png_hist, png_grades, png_box = chart_subject_panels(
+    subj_sel, s, grade_mat.loc[subj_sel], m_vals, f_vals
+)
+
+ca, cb, cc = st.columns(3)
+
+with ca:
+    st.image(png_hist, use_column_width=True)
+
+with cb:
+    st.image(png_grades, use_column_width=True)
+
+with cc:
+    st.image(png_box, use_column_width=True)
 
 t1, t2 = st.columns(2)
-df_subj = df[["Rank", "Name", "Roll", "Gender", mc, gc, "Total"]].copy()
-df_subj[mc] = pd.to_numeric(df_subj[mc], errors="coerce")
-df_subj = df_subj.sort_values(mc, ascending=False).reset_index(drop=True)
-df_subj.index += 1
+subj_cols = ["Rank", "Name", "Roll", "Gender", mc, gc, "Total"]
+top_subj, bot_subj = sa.top_bottom(df[subj_cols], mc, top_n)
+top_subj = top_subj.reset_index(drop=True)
+top_subj.index += 1
 
 with t1:
     st.markdown(f"**🏆 Top {top_n} in {SUBJ_LABELS[subj_sel]}**")
     st.dataframe(
-        df_subj.head(top_n).rename(columns={mc: "Marks", gc: "Grade"}),
+        top_subj.rename(columns={mc: "Marks", gc: "Grade"}),
         use_container_width=True, hide_index=False
     )
 with t2:
     st.markdown(f"**⚠️ Bottom {top_n} in {SUBJ_LABELS[subj_sel]}**")
     st.dataframe(
-        df_subj.tail(top_n).iloc[::-1].reset_index(drop=True).rename(columns={mc: "Marks", gc: "Grade"}),
+        bot_subj.reset_index(drop=True).rename(columns={mc: "Marks", gc: "Grade"}),
         use_container_width=True, hide_index=True
     )
 
@@ -398,10 +468,9 @@ st.divider()
 # ══════════════════════════════════════════════════════════════════════════════
 st.subheader("🏆 Overall Rankings")
 
-df_rank = df.sort_values("Total", ascending=False).reset_index(drop=True)
-df_rank.index += 1
-disp_cols  = ["Rank", "Name", "Gender", "Lang2_Name",
-              "English_M", "Lang2_M", "Maths_M", "Science_M", "Social_M", "Total"]
+# parse() already returns the class in rank order (Total desc, Name asc),
+# so the top / bottom N are plain slices — no re-sort needed.
+disp_cols  = ["Rank", "Name", "Gender", "Lang2_Name", *MARK_COLS, "Total"]
 rename_map = {"Lang2_Name": "2nd Lang", "English_M": "English", "Lang2_M": "Lang2",
               "Maths_M": "Maths", "Science_M": "Science", "Social_M": "Social"}
 
@@ -409,13 +478,13 @@ r1, r2 = st.columns(2)
 with r1:
     st.markdown(f"**🥇 Top {top_n} Students**")
     st.dataframe(
-        df_rank[disp_cols].head(top_n).rename(columns=rename_map),
+        df.head(top_n)[disp_cols].rename(columns=rename_map),
         use_container_width=True, hide_index=True
     )
 with r2:
     st.markdown(f"**⬇️ Bottom {top_n} Students**")
     st.dataframe(
-        df_rank[disp_cols].tail(top_n).iloc[::-1].reset_index(drop=True).rename(columns=rename_map),
+        df.tail(top_n).iloc[::-1][disp_cols].reset_index(drop=True).rename(columns=rename_map),
         use_container_width=True, hide_index=True
     )
 
@@ -426,18 +495,9 @@ st.divider()
 # ══════════════════════════════════════════════════════════════════════════════
 st.subheader("📈 Grade Summary")
 
-present_g = [g for g in sa.GRADE_ORDER
-             if any(df[f"{s}_G"].eq(g).any() for s in SUBJECTS)]
-gs_data = []
-for subj in SUBJECTS:
-    row = {"Subject": SUBJ_LABELS[subj]}
-    for g in present_g:
-        row[g] = int(df[f"{subj}_G"].eq(g).sum())
-    a1a2 = row.get("A1", 0) + row.get("A2", 0)
-    row["A1+A2 %"] = f"{a1a2 / len(df) * 100:.0f}%"
-    gs_data.append(row)
-
-gs_df = pd.DataFrame(gs_data).set_index("Subject")
+gs_df = grade_mat[present_g].rename(index=SUBJ_LABELS).rename_axis("Subject")
+gs_df["A1+A2 %"] = [f"{n / len(df) * 100:.0f}%"
+                    for n in grade_mat[["A1", "A2"]].sum(axis=1)]
 st.dataframe(gs_df, use_container_width=True)
 
 st.divider()
@@ -447,15 +507,15 @@ st.divider()
 # ══════════════════════════════════════════════════════════════════════════════
 st.subheader("⚠️ Students Needing Attention")
 
-thr  = df["Total"].mean() - df["Total"].std()
-flag = df[mark_cols].lt(60).any(axis=1) | df["Total"].lt(thr)
-df_na = df[flag].sort_values("Total").reset_index(drop=True)
+thr  = df["Total"].mean() - df["Total"].astype("float64").std()
+flag = df[MARK_COLS].lt(60).any(axis=1) | df["Total"].lt(thr)
+df_na = df[flag].sort_values("Total", ignore_index=True)
 st.caption(f"{len(df_na)} students flagged — any subject below 60 marks, or total below {thr:.0f}")
 if df_na.empty:
     st.success("No students need attention — great class performance! 🎉")
 else:
     st.dataframe(
-        df_na[["Rank", "Name", "Gender", "English_M", "Lang2_M", "Maths_M", "Science_M", "Social_M", "Total"]]
+        df_na[["Rank", "Name", "Gender", *MARK_COLS, "Total"]]
         .rename(columns=rename_map),
         use_container_width=True, hide_index=True
     )
@@ -483,7 +543,7 @@ English · 2nd Language · Mathematics · Science · Social Science · Needs Att
 if st.button("Generate Excel Report", type="primary"):
     with st.spinner("Building Excel report..."):
         try:
-            data = sa.build_excel(df)
+            data = build_excel_bytes(df)
             st.download_button(
                 "📥 Download CBSE_Result_Analysis.xlsx",
                 data=data,
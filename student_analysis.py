@@ -1,3 +1,5 @@
+import mmap
+import os
 import re
 import pandas as pd
 import numpy as np
@@ -58,19 +60,47 @@ LANG2_CODES = {
 # Codes that are valid Maths-slot subjects (position index 2)
 MATHS_SLOT_CODES = {"041", "241"}
 
-GRADE_ORDER = ["A1","A2","B1","B2","C1","C2","D1","D2","E1","E2","F"]
+GRADE_ORDER = ["A1","A2","B1","B2","C1","C2","D1","D2","E1","E2","E","F"]
+# dtype of the {subject}_G columns: best grade first, missing grade → NaN
+GRADE_DTYPE = pd.CategoricalDtype(GRADE_ORDER, ordered=True)
 
 GRADE_COLORS = {
     "A1":"1a9850","A2":"66bd63",
     "B1":"3182bd","B2":"6baed6",
     "C1":"fdae61","C2":"f46d43",
     "D1":"d73027","D2":"a50026",
-    "E1":"969696","E2":"636363","F":"252525",
+    "E1":"969696","E2":"636363","E":"525252","F":"252525",
 }
 
+# ── Gazette line patterns (compiled once, used per student line) ──────────────
+# Byte patterns: the gazette is scanned as raw bytes (see parse_bytes) and
+# only the captured fields are decoded.
+# Use \b\d{2,3}\s+[A-F]\d\b to avoid false match on "026    C.B.S.E." in header.
+_GRADE_PAIR_RE   = re.compile(rb"\b\d{2,3}\s+[A-F]\d\b")
+_ROLL_PREFIX_RE  = re.compile(rb"\s*\d{8}")
+_MARKS_ONLY_RE   = re.compile(rb"\s{10,}\d{2,3}\s")
+_CODE_RE         = re.compile(rb"\d{3}")
+_BARE_MARK_RE    = re.compile(rb"\b(\d{2,3})\b")
+_MARK_GRADE_RE   = re.compile(rb"(\d{1,3})\s+([A-F]\d?)")
+# Bytes that end a line — the single-byte separators str.splitlines() splits
+# on, so a form feed (page break) or \v starts a new line just as \n does.
+_EOL             = rb"\n\r\v\f\x1c-\x1e"
+_LINE_RE         = re.compile(rb"[^" + _EOL + rb"]+")
+# One student record: header line, any blank lines, then the indented marks
+# line (optional — never another student's header). Fields are separated by
+# [ \t], the whitespace that cannot run past the end of the line.
+_RECORD_RE       = re.compile(
+    rb"(?:\A|(?<=[" + _EOL + rb"]))"
+    rb"(\d{8})[ \t]+([MF])[ \t]+([^" + _EOL + rb"]+?)[ \t]{3,}((?:[ \t]*\d{3})+)[ \t]+"
+    rb"(PASS|FAIL|COMP|ESSEN|ABSE)[^" + _EOL + rb"]*(?:\r\n|[" + _EOL + rb"]|\Z)"
+    rb"(?:[ \t]*(?:\r\n|[" + _EOL + rb"]))*"
+    rb"(?:([ \t]+(?!\d{8})\d{2,3}[^" + _EOL + rb"]*))?"
+)
+
 SUBJECTS     = ["English","Lang2","Maths","Science","Social"]
 SUBJ_LABELS  = {"English":"English","Lang2":"2nd Language",
                 "Maths":"Mathematics","Science":"Science","Social":"Social Science / Painting"}
+MARK_COLS    = [f"{s}_M" for s in SUBJECTS]
 
 
 def subject_name_from_code(code):
@@ -79,6 +109,12 @@ def subject_name_from_code(code):
     return SUBJECT_CODE_MAP.get(code, code)
 
 
+def _decode_labels(values):
+    """Decode a column of short ASCII byte labels once per distinct value."""
+    cat = pd.Categorical(values)
+    return cat.rename_categories([c.decode("ascii") for c in cat.categories])
+
+
 def parse(lines_or_path):
     """
     Parse CBSE gazette text files.
@@ -90,105 +126,151 @@ def parse(lines_or_path):
                  e.g.  096    089    066    063    081
 
     Auto-detects the format from the first marks line found.
-    Grade letters are left empty ("") for Format B files.
+    Grade letters are left missing (NaN) for Format B files.
     """
     if isinstance(lines_or_path, str):
-        with open(lines_or_path, "r", encoding="utf-8", errors="ignore") as f:
-            lines = f.read().splitlines()
-    else:
-        lines = lines_or_path
+        # Memory-map the file and scan it in place — no decoded copy.
+        with open(lines_or_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return parse_bytes(b"")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return parse_bytes(mm)
+    return parse_text("\n".join(line.rstrip("\r") for line in lines_or_path))
+
+
+def parse_text(text):
+    """Parse the full text of a CBSE gazette (see ``parse`` for the formats)."""
+    return parse_bytes(text.encode("utf-8"))
+
+
+def parse_bytes(buf):
+    """
+    Parse a CBSE gazette from raw bytes — ``bytes``, an ``mmap`` or any other
+    buffer (see ``parse`` for the formats).
 
+    Student records are located with a single regex sweep over the whole
+    buffer instead of walking it line by line. Only the captured fields are
+    decoded: names as UTF-8 (invalid bytes dropped), codes / grades once per
+    distinct value.
+    """
     # ── Auto-detect format ──────────────────────────────────────────────────
     # Format A: marks line has "096 A1  089 B2" (digit + space + grade letter+digit)
     # Format B: marks line has "096    089    066" (digits only)
-    # Use \b\d{2,3}\s+[A-F]\d\b to avoid false match on "026    C.B.S.E." in header.
-    GRADE_PAT = re.compile(r"\b\d{2,3}\s+[A-F]\d\b")
     fmt_b = True   # default: marks-only (Format B)
-    for line in lines:
-        if re.match(r"\s*\d{8}", line):       # student header line — skip
+    for lm in _LINE_RE.finditer(buf):
+        line = lm.group()
+        if _ROLL_PREFIX_RE.match(line):       # student header line — skip
             continue
-        if GRADE_PAT.search(line):
+        if _GRADE_PAIR_RE.search(line):
             fmt_b = False   # grade letters present → Format A
             break
-        if re.match(r"\s{10,}\d{2,3}\s", line):  # indented marks-only line
+        if _MARKS_ONLY_RE.match(line):  # indented marks-only line
             fmt_b = True    # numbers only → Format B
             break
 
-    records = []
-    i = 0
-    while i < len(lines):
-        line = lines[i].rstrip("\r")
-        m = re.match(
-            r"(\d{8})\s+([MF])\s+(.+?)\s{3,}((?:\s*\d{3})+)\s+(PASS|FAIL|COMP|ESSEN|ABSE)",
-            line
+    # Column-oriented accumulation: one list per output column, in order.
+    # "Lang2_Name" doubles as the Lang2 subject name and is filled below.
+    cols = {c: [] for c in ("Roll", "Name", "Gender", "Result", "Lang2_Name",
+                            "Has_BasicMaths", "Has_PaintSocial")}
+    for subj in SUBJECTS:
+        for suffix in ("_Code", "_Name", "_M", "_G"):
+            cols[f"{subj}{suffix}"] = []
+    # Per-subject (code, mark, grade) lists, looked up once rather than by
+    # building three f-string keys per subject per student.
+    subj_lists = [(cols[f"{s}_Code"], cols[f"{s}_M"], cols[f"{s}_G"]) for s in SUBJECTS]
+
+    for m in _RECORD_RE.finditer(buf):
+        roll, gender, name = m.group(1), m.group(2), m.group(3).strip()
+        codes      = _CODE_RE.findall(m.group(4))
+        result     = m.group(5)
+        marks_line = m.group(6) or b""
+
+        if fmt_b:
+            # Format B: extract bare numbers
+            marks  = _BARE_MARK_RE.findall(marks_line)
+            grades = [b""] * len(marks)
+        else:
+            # Format A: extract (mark, grade) pairs
+            pairs  = _MARK_GRADE_RE.findall(marks_line)
+            marks  = [p[0] for p in pairs]
+            grades = [p[1] for p in pairs]
+
+        cols["Roll"].append(roll.decode("ascii"))
+        cols["Name"].append(name.decode("utf-8", errors="ignore"))
+        cols["Gender"].append(gender)
+        cols["Result"].append(result)
+
+        # Marks stay as the captured digit bytes; they are converted to
+        # integers a whole column at a time below.
+        for idx, (code_l, mark_l, grade_l) in enumerate(subj_lists):
+            code_l.append(codes[idx]   if idx < len(codes)  else b"")
+            mark_l.append(marks[idx]   if idx < len(marks)  else b"")
+            grade_l.append(grades[idx] if idx < len(grades) else b"")
+
+    # ── Identify subject roles (whole columns at once, not per student) ──
+    # Names: same rule as subject_name_from_code — unknown codes map to themselves.
+    for subj in SUBJECTS:
+        cols[f"{subj}_Code"] = np.asarray(_decode_labels(cols[f"{subj}_Code"]), dtype=object)
+        code_ser = pd.Series(cols[f"{subj}_Code"], dtype=object)
+        cols[f"{subj}_Name"] = code_ser.map(SUBJECT_CODE_MAP).fillna(code_ser).to_numpy()
+    cols["Has_BasicMaths"]  = np.array(cols["Maths_Code"],  dtype=object) == "241"
+    cols["Has_PaintSocial"] = np.array(cols["Social_Code"], dtype=object) == "049"
+
+    # Marks are 0–100, so nullable Int16 (missing subject → <NA>) is plenty;
+    # gender and grade letters are a handful of repeated labels → category.
+    # Grade tokens outside GRADE_ORDER are kept as extra categories after it,
+    # so a NaN grade always means the gazette printed no grade letter.
+    grades = {subj: _decode_labels(cols[f"{subj}_G"]) for subj in SUBJECTS}
+    extra  = sorted({g for cat in grades.values() for g in cat.categories}
+                    - set(GRADE_ORDER) - {""})
+    grade_dtype = pd.CategoricalDtype(GRADE_ORDER + extra, ordered=True) if extra else GRADE_DTYPE
+    for subj in SUBJECTS:
+        raw     = np.array(cols[f"{subj}_M"], dtype="S3")
+        missing = raw == b""
+        cols[f"{subj}_M"] = pd.arrays.IntegerArray(
+            np.where(missing, b"0", raw).astype(np.int16), missing
         )
-        if m:
-            roll, gender, name = m.group(1), m.group(2), m.group(3).strip()
-            codes  = re.findall(r"\d{3}", m.group(4))
-            result = m.group(5)
-
-            # ── Advance to the marks line (skip blank lines only) ────────────
-            j = i + 1
-            while j < len(lines) and lines[j].strip() == "":
-                j += 1
-
-            marks_line = lines[j] if j < len(lines) else ""
-            # Safety: don't consume another student's header line
-            is_marks_line = (
-                re.match(r"\s+\d{2,3}", marks_line)
-                and not re.match(r"\d{8}", marks_line.strip())
-            )
+        cols[f"{subj}_G"] = grades[subj].astype(grade_dtype)
+    cols["Gender"] = _decode_labels(cols["Gender"])
+    cols["Result"] = np.asarray(_decode_labels(cols["Result"]), dtype=object)
 
-            if fmt_b:
-                # Format B: extract bare numbers
-                marks  = re.findall(r"\b(\d{2,3})\b", marks_line) if is_marks_line else []
-                grades = [""] * len(marks)
-            else:
-                # Format A: extract (mark, grade) pairs
-                pairs  = re.findall(r"(\d{1,3})\s+([A-F]\d?)", marks_line) if is_marks_line else []
-                marks  = [p[0] for p in pairs]
-                grades = [p[1] for p in pairs]
-
-            # ── Identify subject roles ───────────────────────────────────────
-            lang2_code = codes[1] if len(codes) > 1 else ""
-            maths_code = codes[2] if len(codes) > 2 else ""
-
-            rec = {
-                "Roll":         roll,
-                "Name":         name,
-                "Gender":       gender,
-                "Result":       result,
-                "Lang2_Name":   subject_name_from_code(lang2_code),
-                "Has_BasicMaths":  maths_code == "241",
-                "Has_PaintSocial": (codes[4] if len(codes) > 4 else "") == "049",
-            }
-
-            for idx, subj in enumerate(SUBJECTS):
-                code = codes[idx]  if idx < len(codes)  else ""
-                rec[f"{subj}_Code"] = code
-                rec[f"{subj}_Name"] = subject_name_from_code(code)
-                rec[f"{subj}_M"]    = int(marks[idx])  if idx < len(marks)  else np.nan
-                rec[f"{subj}_G"]    = grades[idx]       if idx < len(grades) else ""
-
-            records.append(rec)
-            i = j + 1
-        else:
-            i += 1
+    # Total: plain int32 sum of the mark arrays, a missing subject counting 0.
+    total = np.zeros(len(cols["Roll"]), dtype=np.int32)
+    for mc in MARK_COLS:
+        total += cols[mc].to_numpy(dtype=np.int32, na_value=0)
+    cols["Total"] = pd.array(total, dtype="Int32")
 
-    df = pd.DataFrame(records)
-    mark_cols = [f"{s}_M" for s in SUBJECTS]
-    df["Total"] = df[mark_cols].sum(axis=1)
+    df = pd.DataFrame(cols)
     # Sort by Total desc, then Name asc to break ties alphabetically,
     # then assign sequential rank so every student gets a unique position.
-    df = df.sort_values(["Total", "Name"], ascending=[False, True]).reset_index(drop=True)
+    df = df.sort_values(["Total", "Name"], ascending=[False, True], ignore_index=True)
     df["Rank"] = range(1, len(df) + 1)
     return df
 
 
+def top_bottom(df, col, n):
+    """
+    Return (top, bottom): the n rows of ``df`` with the highest ``col``
+    (best first) and the n with the lowest (worst first). Missing values
+    rank lowest. Ties keep the frame's own order (rank order for parse()
+    output): best-ranked first in the top list, worst-ranked first in the
+    bottom, so rows tied at the cutoff are chosen the same way every time.
+    """
+    vals = df[col].to_numpy(dtype="float64", na_value=-np.inf)
+    k = min(n, len(vals))
+    if k == 0:
+        return df.iloc[:0], df.iloc[:0]
+    order = np.argsort(-vals, kind="stable")
+    return df.iloc[order[:k]], df.iloc[order[::-1][:k]]
+
+
 def _safe_stats(s_ser):
     """Return (mean, median, max, min, std) safely even if series is empty."""
     if s_ser.empty:
         return 0.0, 0.0, 0, 0, 0.0
+    # Nullable Int16 reductions give <NA> (not NaN) for e.g. the std of one
+    # mark, which float() / round() reject — reduce as float64 instead.
+    s_ser = s_ser.astype("float64")
     return (
         round(float(s_ser.mean()), 1),
         round(float(s_ser.median()), 1),
@@ -198,7 +280,43 @@ def _safe_stats(s_ser):
     )
 
 
+def subject_stats(df):
+    """
+    Same (mean, median, max, min, std) tuple as _safe_stats, for every
+    subject at once: one DataFrame.agg over the five mark columns.
+    """
+    agg = df[MARK_COLS].astype("float64").agg(["count", "mean", "median", "max", "min", "std"])
+    stats = {}
+    for subj in SUBJECTS:
+        c = agg[f"{subj}_M"]
+        if c["count"] == 0:
+            stats[subj] = (0.0, 0.0, 0, 0, 0.0)
+            continue
+        stats[subj] = (
+            round(float(c["mean"]), 1),
+            round(float(c["median"]), 1),
+            int(c["max"]),
+            int(c["min"]),
+            round(float(c["std"]), 1),
+        )
+    return stats
+
+
+def grade_matrix(df):
+    """Subject × grade count matrix: rows SUBJECTS, columns GRADE_ORDER."""
+    counts = {subj: df[f"{subj}_G"].value_counts(sort=False) for subj in SUBJECTS}
+    return (pd.DataFrame(counts).T
+              .reindex(index=SUBJECTS, columns=GRADE_ORDER)
+              .fillna(0).astype(int))
+
+
 def build_excel(df):
+    """
+    Build the full Excel report for a frame from ``parse`` and return it as
+    xlsx bytes. ``df`` is expected in parse's rank order (Total desc, Name
+    asc); the rank-ordered sheets iterate it directly instead of re-sorting
+    a copy.
+    """
     from openpyxl import Workbook
     from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
     from openpyxl.utils import get_column_letter
@@ -275,6 +393,12 @@ def build_excel(df):
     # Count painting students for dashboard display
     painting_count = int(df.get("Has_BasicMaths", pd.Series(False)).sum()) if "Has_BasicMaths" in df.columns else 0
 
+    # Per-subject statistics and grade counts, computed once and shared by
+    # the Dashboard, Grade Distribution and per-subject sheets below.
+    subj_stats = subject_stats(df)
+    grade_mat  = grade_matrix(df)
+    a1a2_cnt   = grade_mat[["A1", "A2"]].sum(axis=1)
+
     # ══════════════════════════════════════════════════════════════════════════
     # SHEET 1 — All Students
     # ══════════════════════════════════════════════════════════════════════════
@@ -301,8 +425,7 @@ def build_excel(df):
     for ci, lbl in enumerate(hdrs1, 1):
         hdr(ws1.cell(2, ci), lbl, bg=C_MID)
 
-    df1 = df.sort_values("Total", ascending=False).reset_index(drop=True)
-    for ri, (_, row) in enumerate(df1.iterrows(), 3):
+    for ri, (_, row) in enumerate(df.iterrows(), 3):
         ws1.row_dimensions[ri].height = 18
         alt = ri % 2 == 0
         # Maths (Basic) students get a warm background tint
@@ -402,19 +525,12 @@ def build_excel(df):
 
     for ri, subj in enumerate(SUBJECTS, 9):
         ws2.row_dimensions[ri].height = 22
-        s_ser = pd.to_numeric(df[f"{subj}_M"], errors="coerce").dropna()
-        a1a2  = df[f"{subj}_G"].isin(["A1","A2"]).sum()
-        avg, med, hi, lo, std = _safe_stats(s_ser)
+        a1a2  = a1a2_cnt[subj]
+        avg, med, hi, lo, std = subj_stats[subj]
         # For Maths slot: show split between Maths takers and Maths (Basic) takers
         if subj == "Maths" and painting_count > 0:
-            maths_only = pd.to_numeric(
-                df.loc[~df.get("Has_BasicMaths", pd.Series(False)), f"{subj}_M"],
-                errors="coerce"
-            ).dropna()
-            paint_only = pd.to_numeric(
-                df.loc[df.get("Has_BasicMaths", pd.Series(False)), f"{subj}_M"],
-                errors="coerce"
-            ).dropna()
+            maths_only = df.loc[~df.get("Has_BasicMaths", pd.Series(False)), f"{subj}_M"].dropna()
+            paint_only = df.loc[df.get("Has_BasicMaths", pd.Series(False)), f"{subj}_M"].dropna()
             subj_label = f"Maths (n={len(maths_only)}) / Maths (Basic) (n={len(paint_only)})"
         else:
             subj_label = SUBJ_LABELS[subj]
@@ -443,9 +559,9 @@ def build_excel(df):
     for ci, h in enumerate(["Gender","English","Lang2","Math/Paint","Science","Social","Avg Total","Count"], 1):
         hdr(ws2.cell(17, ci), h, bg=C_DARK)
 
-    for ri, (g, grp) in enumerate(df.groupby("Gender"), 18):
+    for ri, (g, grp) in enumerate(df.groupby("Gender", observed=True), 18):
         ws2.row_dimensions[ri].height = 22
-        avgs  = [round(pd.to_numeric(grp[f"{s}_M"], errors="coerce").mean(), 1) for s in SUBJECTS]
+        avgs  = [round(grp[f"{s}_M"].astype("float64").mean(), 1) for s in SUBJECTS]
         is_f  = (g == "F")
         row_d = [("Female 👩" if is_f else "Male 👦")] + avgs + [round(grp["Total"].mean(), 1), len(grp)]
         rbg   = "FFF0F5" if is_f else "EFF6FF"
@@ -463,7 +579,7 @@ def build_excel(df):
 
     for ri, (lang, grp) in enumerate(lang_list, 23):
         ws2.row_dimensions[ri].height = 22
-        l2_avg   = pd.to_numeric(grp["Lang2_M"], errors="coerce").mean()
+        l2_avg   = grp["Lang2_M"].astype("float64").mean()
         a1a2_pct = f"{grp['Lang2_G'].isin(['A1','A2']).sum()/len(grp)*100:.0f}%"
         vals = [lang, len(grp), f"{len(grp)/len(df)*100:.1f}%",
                 round(grp["Total"].mean(), 1), round(l2_avg, 1), a1a2_pct]
@@ -486,7 +602,7 @@ def build_excel(df):
         for offset, (label, mask) in enumerate(groups):
             ri = paint_row + 2 + offset
             ws2.row_dimensions[ri].height = 22
-            grp_ser = pd.to_numeric(df.loc[mask, "Maths_M"], errors="coerce").dropna()
+            grp_ser = df.loc[mask, "Maths_M"].dropna()
             avg2, med2, hi2, lo2, _ = _safe_stats(grp_ser)
             row_vals = [label, int(mask.sum()), avg2, med2, hi2, lo2]
             rbg = C_PAINT if "Applied" in label else C_ALTROW
@@ -498,9 +614,13 @@ def build_excel(df):
     _DR = 3
     ws2.cell(_DR,   _DC, "Subject")
     ws2.cell(_DR,   _DC+1, "Average")
+    # Chart data keeps numpy's rounding of the raw mean (round() on a
+    # float64), which can differ in the last digit from subj_stats' Python
+    # round(float(...)).
+    subj_means = df[MARK_COLS].astype("float64").mean()
     for ri, subj in enumerate(SUBJECTS, _DR+1):
         ws2.cell(ri, _DC,   SUBJ_LABELS[subj])
-        ws2.cell(ri, _DC+1, round(pd.to_numeric(df[f"{subj}_M"], errors="coerce").mean(), 1))
+        ws2.cell(ri, _DC+1, round(subj_means[f"{subj}_M"], 1))
     ws2.column_dimensions[get_column_letter(_DC)].hidden   = True
     ws2.column_dimensions[get_column_letter(_DC+1)].hidden = True
 
@@ -535,8 +655,7 @@ def build_excel(df):
     ws3.column_dimensions["A"].width = 20
     for i in range(2, 16): col_w(ws3, i, 9)
 
-    present = [g for g in GRADE_ORDER
-               if any(df[f"{s}_G"].eq(g).any() for s in SUBJECTS)]
+    present = [g for g in GRADE_ORDER if grade_mat[g].any()]
     n3 = 1 + len(present) + 2
 
     title_row(ws3, "Grade Distribution — Subject × Grade Matrix", n3)
@@ -557,7 +676,7 @@ def build_excel(df):
         ws3.cell(ri, 1).fill   = PatternFill("solid", fgColor=C_ALTROW if ri%2==0 else C_WHITE)
         total_n = 0; a1a2_n = 0
         for ci, g in enumerate(present, 2):
-            cnt  = int(df[f"{subj}_G"].eq(g).sum())
+            cnt  = int(grade_mat.at[subj, g])
             cell = ws3.cell(ri, ci, cnt if cnt > 0 else "")
             cell.alignment = Alignment(horizontal="center", vertical="center")
             cell.border = brd
@@ -576,7 +695,7 @@ def build_excel(df):
 
     ws3.row_dimensions[8].height = 22
     for ci, g in enumerate(present, 2):
-        cnt = sum(int(df[f"{s}_G"].eq(g).sum()) for s in SUBJECTS)
+        cnt = int(grade_mat[g].sum())
         hdr(ws3.cell(8, ci), cnt, bg=C_DARK)
     hdr(ws3.cell(8, 1), "CLASS TOTAL", bg=C_DARK)
     hdr(ws3.cell(8, len(present)+2), len(df)*5, bg=C_DARK)
@@ -588,7 +707,7 @@ def build_excel(df):
     for ri, subj in enumerate(SUBJECTS, _GD2+1):
         ws3.cell(ri, 1, SUBJ_LABELS[subj])
         for ci, g in enumerate(use_g, 2):
-            ws3.cell(ri, ci, int(df[f"{subj}_G"].eq(g).sum()))
+            ws3.cell(ri, ci, int(grade_mat.at[subj, g]))
 
     bar2 = BarChart(); bar2.type="col"; bar2.grouping="stacked"; bar2.style=10
     bar2.title = "Grade Distribution per Subject"
@@ -624,9 +743,9 @@ def build_excel(df):
     title_row(ws4, "Overall Rank List — CBSE Class X 2026", n4)
     ws4.row_dimensions[2].height = 22
     for ci, h in enumerate(hdrs4, 1): hdr(ws4.cell(2, ci), h, bg=C_MID)
+    int_cols4 = {"Total", *MARK_COLS}
 
-    df4 = df.sort_values("Total", ascending=False).reset_index(drop=True)
-    for ri, (_, row) in enumerate(df4.iterrows(), 3):
+    for ri, (_, row) in enumerate(df.iterrows(), 3):
         ws4.row_dimensions[ri].height = 18
         rank     = int(row["Rank"])
         is_paint = row.get("Has_BasicMaths", False)
@@ -640,7 +759,7 @@ def build_excel(df):
             if col == "Rank":
                 medal = {1:"🥇",2:"🥈",3:"🥉"}.get(rank,"")
                 cell.value = f"{medal} {rank}" if medal else rank
-            elif col in ("Total",) + tuple(f"{s}_M" for s in SUBJECTS) and v != "":
+            elif col in int_cols4 and v != "":
                 cell.value = int(v)
             else:
                 cell.value = v
@@ -675,7 +794,8 @@ def build_excel(df):
         hdr(ws.cell(2,1), "Rank", bg=C_MID)
         for ci, h in enumerate(shdrs, 2): hdr(ws.cell(2, ci), h, bg=C_MID)
 
-        dfs = df.sort_values(f"{subj}_M", ascending=False).reset_index(drop=True)
+        # Stable sort: tied marks keep the frame's rank order.
+        dfs = df.sort_values(f"{subj}_M", ascending=False, ignore_index=True, kind="stable")
         for ri, (_, row) in enumerate(dfs.iterrows(), 3):
             ws.row_dimensions[ri].height = 18
             sr       = ri - 2
@@ -709,9 +829,8 @@ def build_excel(df):
 
         # ── Summary stats block ───────────────────────────────────────────────
         sr2 = len(df) + 4
-        s_s = pd.to_numeric(df[f"{subj}_M"], errors="coerce").dropna()
-        a1a2 = df[f"{subj}_G"].isin(["A1","A2"]).sum()
-        avg, med, hi, lo, std = _safe_stats(s_s)
+        a1a2 = a1a2_cnt[subj]
+        avg, med, hi, lo, std = subj_stats[subj]
 
         title_row(ws, f"{label} — Summary Statistics", ns, row=sr2, bg=C_MID)
         stats_data = [
@@ -726,12 +845,8 @@ def build_excel(df):
 
         # For Maths slot — append Maths (Basic) sub-breakdown
         if subj == "Maths" and painting_count > 0:
-            maths_only = pd.to_numeric(
-                df.loc[~df["Has_BasicMaths"], "Maths_M"], errors="coerce"
-            ).dropna()
-            paint_only = pd.to_numeric(
-                df.loc[df["Has_BasicMaths"],  "Maths_M"], errors="coerce"
-            ).dropna()
+            maths_only = df.loc[~df["Has_BasicMaths"], "Maths_M"].dropna()
+            paint_only = df.loc[df["Has_BasicMaths"],  "Maths_M"].dropna()
             m_avg, _, m_hi, m_lo, _ = _safe_stats(maths_only)
             p_avg, _, p_hi, p_lo, _ = _safe_stats(paint_only)
             stats_data += [
@@ -760,13 +875,13 @@ def build_excel(df):
     ws10.sheet_view.showGridLines = False
 
     avg_t = df["Total"].mean()
-    std_t = df["Total"].std()
+    std_t = df["Total"].astype("float64").std()
     thr   = avg_t - std_t
     flag  = (
-        df[["English_M","Lang2_M","Maths_M","Science_M","Social_M"]].lt(60).any(axis=1) |
+        df[MARK_COLS].lt(60).any(axis=1) |
         df["Total"].lt(thr)
     )
-    df_na = df[flag].sort_values("Total").reset_index(drop=True)
+    df_na = df[flag].sort_values("Total", ignore_index=True)
 
     na_cols = ["Rank","Roll","Name","Gender",
                "English_Code","English_M",
@@ -822,5 +937,4 @@ def build_excel(df):
 
     out = BytesIO()
     wb.save(out)
-    out.seek(0)
     return out.getvalue()
\ No newline at end of file
@@ -0,0 +1,32 @@
+import pandas as pd
+
+import student_analysis as sa
+
+
+def _class(marks):
+    return pd.DataFrame({
+        "Name":      [f"S{i}" for i in range(len(marks))],
+        "English_M": pd.array(marks, dtype="Int16"),
+    })
+
+
+def test_top_bottom_ties_at_cutoff():
+    # 30 students in rank order, 27 of them tied at 50.
+    df = _class([90, 80, 70] + [50] * 27)
+    top, bot = sa.top_bottom(df, "English_M", 5)
+    assert top["Name"].tolist() == ["S0", "S1", "S2", "S3", "S4"]
+    assert bot["Name"].tolist() == ["S29", "S28", "S27", "S26", "S25"]
+
+
+def test_top_bottom_missing_ranks_lowest():
+    df = _class([60, None, 75, 40])
+    top, bot = sa.top_bottom(df, "English_M", 2)
+    assert top["Name"].tolist() == ["S2", "S0"]
+    assert bot["Name"].tolist() == ["S1", "S3"]
+
+
+def test_top_bottom_n_larger_than_class():
+    df = _class([55, 65])
+    top, bot = sa.top_bottom(df, "English_M", 10)
+    assert top["Name"].tolist() == ["S1", "S0"]
+    assert bot["Name"].tolist() == ["S0", "S1"]